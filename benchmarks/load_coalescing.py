@@ -0,0 +1,85 @@
+"""
+Load test for request coalescing: database queries per second must stay flat
+while the number of concurrent identical clients grows.
+
+Runs the app in-process against a throwaway SQLite database, with one thread per
+client, the same way a gunicorn gthread worker serves requests. Every query gets
+an artificial latency (--db-latency) to simulate a network round trip to Postgres.
+
+    $ python benchmarks/load_coalescing.py
+    $ python benchmarks/load_coalescing.py --no-coalesce   # baseline
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,10,50,100", help="comma separated client counts")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of each round")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="seconds added to every query")
+    parser.add_argument("--no-coalesce", action="store_true", help="run every request's own query")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "load.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["RATE_LIMIT_BURST"] = "1000000000"
+    os.environ["RATE_LIMIT_PER_SECOND"] = "1000000000"
+
+    import app as app_module
+    from sqlalchemy import event
+    from models import db, Planet
+
+    if args.no_coalesce:
+        class PassThrough:
+            def do(self, key, fn):
+                return fn()
+        app_module.single_flight = PassThrough()
+
+    app = app_module.app
+    queries = [0]
+    lock = threading.Lock()
+
+    def slow_query(conn, cursor, statement, parameters, context, executemany):
+        with lock:
+            queries[0] += 1
+        time.sleep(args.db_latency)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Planet(name="Tatooine", climate="arid", terrain="desert"))
+        db.session.commit()
+        event.listen(db.engine, "before_cursor_execute", slow_query)
+
+    # /planets/<id> solo pasa por el single-flight (no por la caché de respuestas)
+    print(f"{'clients':>8} {'requests/s':>12} {'queries/s':>10} {'queries/request':>16}")
+    for clients in [int(c) for c in args.concurrency.split(",")]:
+        requests = [0]
+        queries[0] = 0
+        deadline = time.time() + args.seconds
+
+        def client():
+            http = app.test_client()
+            while time.time() < deadline:
+                assert http.get("/planets/1").status_code == 200
+                with lock:
+                    requests[0] += 1
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"{clients:>8} {requests[0] / args.seconds:>12.1f} {queries[0] / args.seconds:>10.1f} "
+              f"{queries[0] / max(requests[0], 1):>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
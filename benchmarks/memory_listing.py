@@ -0,0 +1,59 @@
+"""
+Peak memory (tracemalloc) of building a listing payload from N rows, loading
+full ORM instances versus the read-only namedtuple rows of ReadOnlyMixin.
+
+Uses a throwaway SQLite database filled with People rows.
+
+    $ python benchmarks/memory_listing.py
+    $ python benchmarks/memory_listing.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="people rows to list")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'memory.db')}"
+    from app import app
+    from models import db, People
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(People), [
+            dict(name=f"person {i}", birth_year="19BBY", eye_color="blue", gender="male", hair_color="blond",
+                 height="172", mass="77", skin_color="fair", url=f"https://swapi.dev/api/people/{i}/")
+            for i in range(args.rows)
+        ])
+        db.session.commit()
+
+    # Lo que hacía /people antes: instancias ORM completas, serializadas una a una
+    def orm_instances():
+        return [ppl.serialize() for ppl in db.session.execute(db.select(People)).scalars().all()]
+
+    def read_only_rows():
+        return [People.serialize_row(ppl) for ppl in People.read_only()]
+
+    print(f"{'loader':>16} {'peak MiB':>10}  ({args.rows} rows)")
+    for loader in (orm_instances, read_only_rows):
+        # Cada medición en una sesión nueva para no reutilizar el identity map
+        with app.app_context():
+            tracemalloc.start()
+            payload = loader()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert len(payload) == args.rows
+            db.session.remove()
+        print(f"{loader.__name__:>16} {peak / 2 ** 20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
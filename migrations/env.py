@@ -1,4 +1,6 @@
 import logging
+import os
+import sys
 from logging.config import fileConfig
 
 from flask import current_app
@@ -14,6 +16,13 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+# make migration_helpers importable from the revision files, and the
+# app modules (src/) it shares code with importable from migration_helpers
+migrations_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(migrations_dir), 'src'))
+sys.path.insert(0, migrations_dir)
+from migration_helpers import PROGRESS_TABLE, is_dry_run  # noqa: E402
+
 
 def get_engine():
     try:
@@ -93,9 +102,22 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    # the backfill bookkeeping table is not part of the models
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == "table" and name == PROGRESS_TABLE)
+
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
+    # one transaction per revision, so an autocommit block in
+    # migration_helpers only commits the revision that is running
+    conf_args.setdefault("transaction_per_migration", True)
 
     connectable = get_engine()
 
+    if is_dry_run():
+        run_dry_run(connectable, conf_args)
+        return
+
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
@@ -107,6 +129,32 @@ def run_migrations_online():
             context.run_migrations()
 
 
+def run_dry_run(connectable, conf_args):
+    """Run every pending revision inside one transaction and roll it back.
+
+    The transaction is opened before configuring the context, so Alembic
+    treats it as external and neither the revisions nor the alembic_version
+    update commit. migration_helpers refuses autocommit blocks in this mode.
+
+    """
+    conf_args["transaction_per_migration"] = False
+    with connectable.connect() as connection:
+        transaction = connection.begin()
+        if connection.dialect.name == "sqlite":
+            # pysqlite does not open a transaction before DDL on its own
+            connection.exec_driver_sql("BEGIN")
+        try:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
+            context.run_migrations()
+        finally:
+            transaction.rollback()
+            logger.info('Dry run: all changes rolled back.')
+
+
 if context.is_offline_mode():
     run_migrations_offline()
 else:
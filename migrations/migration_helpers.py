@@ -0,0 +1,188 @@
+"""Helpers for revision files that must not hold long locks on large tables.
+
+Usage from a revision file, importing inside ``upgrade()``/``downgrade()``
+because env.py (which makes this module importable) does not run when
+Alembic only reads the revision files::
+
+    def upgrade():
+        from migration_helpers import create_index_concurrently, batched_backfill
+
+Run ``flask db upgrade -x dry_run=true`` to log the rows each helper would
+touch. env.py runs the whole upgrade in one transaction and rolls it back,
+so nothing is changed and the revision is not recorded.
+
+In offline mode (``flask db upgrade --sql``) there is no database to ask:
+row estimates are skipped, the index DDL is emitted as is and a backfill
+becomes a single UPDATE.
+"""
+import logging
+import time
+
+import sqlalchemy as sa
+from alembic import context, op
+
+import schema_report
+
+logger = logging.getLogger('alembic.helpers')
+
+PROGRESS_TABLE = 'alembic_backfill_progress'
+
+
+def is_dry_run():
+    value = context.get_x_argument(as_dictionary=True).get('dry_run', '')
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def is_postgres():
+    # get_context() también tiene dialecto en modo offline, donde no hay conexión
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def _autocommit_block():
+    # Lo que se ejecuta en autocommit no se puede deshacer con el rollback del dry run
+    if is_dry_run():
+        raise RuntimeError('autocommit blocks cannot run in dry-run mode')
+    return op.get_context().autocommit_block()
+
+
+def estimate_rows(table_name, where=None):
+    if context.is_offline_mode():
+        return None
+    return schema_report.estimate_rows(op.get_bind(), table_name, where)
+
+
+def _drop_invalid_index(index_name):
+    # Un CREATE INDEX CONCURRENTLY interrumpido deja un índice inválido que hay que rehacer.
+    # En modo offline no se puede consultar pg_index: el script solo lleva el CREATE.
+    if context.is_offline_mode():
+        return
+    invalid = op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"
+    ), {'name': index_name}).scalar()
+    if invalid:
+        logger.info('Dropping invalid index %s left by a previous run', index_name)
+        op.drop_index(index_name, postgresql_concurrently=True, if_exists=True)
+
+
+def create_index_concurrently(index_name, table_name, columns, **kw):
+    """Create an index without blocking writes on Postgres.
+
+    CONCURRENTLY cannot run inside a transaction, so the statement runs in an
+    autocommit block. Other databases get a plain CREATE INDEX.
+    """
+    if is_dry_run():
+        logger.info('[dry run] index %s on %s(%s) would scan %s rows',
+                    index_name, table_name, ', '.join(columns), estimate_rows(table_name))
+        return
+
+    if is_postgres():
+        with _autocommit_block():
+            _drop_invalid_index(index_name)
+            op.create_index(index_name, table_name, columns, postgresql_concurrently=True,
+                            if_not_exists=True, **kw)
+    else:
+        op.create_index(index_name, table_name, columns, **kw)
+
+
+def drop_index_concurrently(index_name, table_name):
+    if is_dry_run():
+        logger.info('[dry run] index %s on %s would be dropped', index_name, table_name)
+        return
+
+    if is_postgres():
+        with _autocommit_block():
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
+    else:
+        op.drop_index(index_name, table_name=table_name)
+
+
+def _progress_table():
+    return sa.table(PROGRESS_TABLE, sa.column('name'), sa.column('last_key'), sa.column('rows'))
+
+
+def _load_progress(name):
+    bind = op.get_bind()
+    metadata = sa.MetaData()
+    sa.Table(PROGRESS_TABLE, metadata,
+             sa.Column('name', sa.String(100), primary_key=True),
+             sa.Column('last_key', sa.BigInteger(), nullable=False),
+             sa.Column('rows', sa.BigInteger(), nullable=False))
+    metadata.create_all(bind)
+    progress = _progress_table()
+    row = bind.execute(sa.select(progress.c.last_key, progress.c.rows)
+                       .where(progress.c.name == name)).first()
+    if row is None:
+        bind.execute(sa.insert(progress).values(name=name, last_key=0, rows=0))
+        return 0, 0
+    return row.last_key, row.rows
+
+
+def batched_backfill(name, table_name, values, where=None, key='id', batch_size=1000, pause=0.1):
+    """Run ``UPDATE table_name SET values`` in keyset batches of ``batch_size`` rows.
+
+    ``values`` maps column names to SQL expressions and ``where`` is an
+    optional SQL condition. Progress is stored under ``name`` after every
+    batch, so a failed or interrupted run resumes where it stopped, and is
+    deleted once the backfill finishes. ``where``
+    should exclude rows already backfilled so a repeated batch is harmless.
+    On Postgres every batch commits on its own to keep locks short.
+    Returns the number of rows updated (or that would be, in dry-run mode;
+    None in offline mode).
+    """
+    if is_dry_run():
+        rows = estimate_rows(table_name, where)
+        logger.info('[dry run] backfill %s would update %s rows of %s in batches of %s',
+                    name, rows, table_name, batch_size)
+        return rows
+
+    if context.is_offline_mode():
+        # Sin conexión no se pueden recorrer las claves por lotes
+        target, condition, update_values = _backfill_update(table_name, values, where, key)
+        op.execute(sa.update(target).where(condition).values(update_values))
+        return None
+
+    if is_postgres():
+        with _autocommit_block():
+            return _run_backfill(name, table_name, values, where, key, batch_size, pause)
+    return _run_backfill(name, table_name, values, where, key, batch_size, pause)
+
+
+def _backfill_update(table_name, values, where, key):
+    target = sa.table(table_name, sa.column(key), *[sa.column(column) for column in values])
+    condition = sa.text(where) if where is not None else sa.true()
+    update_values = {column: sa.literal_column(expression) for column, expression in values.items()}
+    return target, condition, update_values
+
+
+def _run_backfill(name, table_name, values, where, key, batch_size, pause):
+    bind = op.get_bind()
+    target, condition, update_values = _backfill_update(table_name, values, where, key)
+    key_column = target.c[key]
+    progress = _progress_table()
+    last_key, rows = _load_progress(name)
+    total = estimate_rows(table_name, where)
+    logger.info('Backfill %s: %s rows to update, resuming after %s=%s', name, total, key, last_key)
+
+    while True:
+        keys = bind.execute(
+            sa.select(key_column).where(key_column > last_key, condition)
+            .order_by(key_column).limit(batch_size)
+        ).scalars().all()
+        if not keys:
+            break
+
+        result = bind.execute(
+            sa.update(target)
+            .where(key_column.between(keys[0], keys[-1]), condition)
+            .values(update_values)
+        )
+        last_key = keys[-1]
+        rows += result.rowcount
+        bind.execute(sa.update(progress).where(progress.c.name == name).values(last_key=last_key, rows=rows))
+        logger.info('Backfill %s: %s/%s rows (%s=%s)', name, rows, total, key, last_key)
+        time.sleep(pause)
+
+    # Terminado: se borra el progreso para que otra ejecución con el mismo nombre empiece de cero
+    bind.execute(sa.delete(progress).where(progress.c.name == name))
+    logger.info('Backfill %s: done, %s rows updated', name, rows)
+    return rows
@@ -0,0 +1,58 @@
+"""add edited timestamps and tombstones to catalog tables
+
+Revision ID: 2c6f0a9d4e71
+Revises: 8d6e307eaf5e
+Create Date: 2026-10-19 10:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c6f0a9d4e71'
+down_revision = '8d6e307eaf5e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tombstone_deleted_at'), ['deleted_at'], unique=False)
+
+    # Las filas existentes toman la hora de la migración como su última edición
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('edited', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+        batch_op.create_index(batch_op.f('ix_planet_edited'), ['edited'], unique=False)
+
+    with op.batch_alter_table('vehicle', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('edited', sa.DateTime(), server_default=sa.func.now(), nullable=False))
+        batch_op.create_index(batch_op.f('ix_vehicle_edited'), ['edited'], unique=False)
+
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_people_edited'), ['edited'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('people', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_people_edited'))
+
+    with op.batch_alter_table('vehicle', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_vehicle_edited'))
+        batch_op.drop_column('edited')
+
+    with op.batch_alter_table('planet', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_planet_edited'))
+        batch_op.drop_column('edited')
+
+    with op.batch_alter_table('tombstone', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tombstone_deleted_at'))
+
+    op.drop_table('tombstone')
@@ -0,0 +1,40 @@
+"""index foreign key columns without locking writes
+
+Revision ID: 7a4d9e2b1c35
+Revises: 2c6f0a9d4e71
+Create Date: 2026-10-19 11:03:47.518230
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4d9e2b1c35'
+down_revision = '2c6f0a9d4e71'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_favorite_user_id', 'favorite', ['user_id']),
+    ('ix_favorite_people_id', 'favorite', ['people_id']),
+    ('ix_favorite_planet_id', 'favorite', ['planet_id']),
+    ('ix_favorite_vehicle_id', 'favorite', ['vehicle_id']),
+    ('ix_post_user_id', 'post', ['user_id']),
+    ('ix_comment_user_id', 'comment', ['user_id']),
+    ('ix_comment_post_id', 'comment', ['post_id']),
+]
+
+
+# migration_helpers is put on sys.path by env.py, which does not run when
+# alembic only reads this file (flask db heads/history), so import it here
+def upgrade():
+    from migration_helpers import create_index_concurrently
+
+    for index_name, table_name, columns in INDEXES:
+        create_index_concurrently(index_name, table_name, columns)
+
+
+def downgrade():
+    from migration_helpers import drop_index_concurrently
+
+    for index_name, table_name, columns in reversed(INDEXES):
+        drop_index_concurrently(index_name, table_name)
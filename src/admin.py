@@ -1,5 +1,6 @@
 import os
-from flask_admin import Admin
+from flask import current_app, jsonify, send_file
+from flask_admin import Admin, BaseView, expose
 from models import db, User, People, Planet, Vehicle, Favorite
 from flask_admin.contrib.sqla import ModelView
 
@@ -7,6 +8,24 @@ from flask_admin.contrib.sqla import ModelView
 class FavoriteAdmin(ModelView):
     column_list=["id", "user", "planet", "people", "vehicle"] 
 
+# Muestra el informe del esquema; si aún no existe lo genera otro proceso y responde 202
+class SchemaReportView(BaseView):
+    @expose('/')
+    def index(self):
+        report = current_app.extensions["schema_reports"].get_or_submit()
+        if report is None:
+            return jsonify({"status": "pending"}), 202
+        return jsonify(report)
+
+    @expose('/diagram')
+    def diagram(self):
+        report = current_app.extensions["schema_reports"].get_or_submit()
+        if report is None:
+            return jsonify({"status": "pending"}), 202
+        if report["diagram"] is None:
+            return jsonify({"status": "unavailable", "error": report.get("diagram_error")}), 404
+        return send_file(report["diagram"], mimetype="image/png")
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -20,6 +39,8 @@ def setup_admin(app):
     admin.add_view(ModelView(User, db.session))
     admin.add_view(ModelView(Vehicle, db.session))
     admin.add_view(FavoriteAdmin(Favorite, db.session))
+    if app.config.get('SCHEMA_REPORT_ADMIN'):
+        admin.add_view(SchemaReportView(name='Schema report', endpoint='schema_report'))
     
 
     # You can duplicate that line to add mew models
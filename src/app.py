@@ -2,13 +2,20 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import gzip
+from datetime import datetime, timedelta, timezone
 from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from utils import APIException, generate_sitemap
 from admin import setup_admin
-from models import db, User, People, Planet, Favorite
+from models import db, User, People, Planet, Vehicle, Favorite, Tombstone, CATALOG_MODELS, utcnow, session_options
+from throttle import SingleFlight, RateLimiter, metrics
+from schema_report import SchemaReports
+from response_cache import ResponseCache
+from profiling import Profiler
 #from models import Person
 
 app = Flask(__name__)
@@ -20,17 +27,93 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['RATE_LIMIT_ENABLED'] = os.getenv("RATE_LIMIT_ENABLED") == "1"
+app.config['RATE_LIMIT_PER_SECOND'] = float(os.getenv("RATE_LIMIT_PER_SECOND", 10))
+app.config['RATE_LIMIT_BURST'] = int(os.getenv("RATE_LIMIT_BURST", 20))
+# Solo activar detrás de un proxy que autentique al usuario y fije X-User-Id
+app.config['RATE_LIMIT_TRUST_USER_ID'] = os.getenv("RATE_LIMIT_TRUST_USER_ID") == "1"
+# Número de proxies delante de la app (Render y Heroku ponen uno) cuyo X-Forwarded-For se acepta
+app.config['PROXY_FIX_HOPS'] = int(os.getenv("PROXY_FIX_HOPS", 0))
+app.config['CHANGES_SAFETY_WINDOW'] = float(os.getenv("CHANGES_SAFETY_WINDOW", 60))
+app.config['SCHEMA_REPORT_DIR'] = os.getenv("SCHEMA_REPORT_DIR", "/tmp/schema_reports")
+app.config['SCHEMA_REPORT_ADMIN'] = os.getenv("SCHEMA_REPORT_ADMIN") == "1"
+app.config['SCHEMA_REPORT_RETRY_AFTER'] = float(os.getenv("SCHEMA_REPORT_RETRY_AFTER", 60))
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv("RESPONSE_CACHE_BACKEND", "sqlite")
+app.config['RESPONSE_CACHE_PATH'] = os.getenv("RESPONSE_CACHE_PATH", "/tmp/response_cache.db")
+app.config['RESPONSE_CACHE_URL'] = os.getenv("RESPONSE_CACHE_URL")
+app.config['RESPONSE_CACHE_TTL'] = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+app.config['RESPONSE_CACHE_STATS_FLUSH_INTERVAL'] = float(os.getenv("RESPONSE_CACHE_STATS_FLUSH_INTERVAL", 5))
+app.config['PROFILING_ENABLED'] = os.getenv("PROFILING_ENABLED") == "1"
+app.config['PROFILING_SECRET'] = os.getenv("PROFILING_SECRET")
+app.config['PROFILING_SAMPLE_RATE'] = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+app.config['PROFILING_MAX_PER_MINUTE'] = int(os.getenv("PROFILING_MAX_PER_MINUTE", 6))
+app.config['PROFILING_DIR'] = os.getenv("PROFILING_DIR", "/tmp/profiles")
+app.config['PROFILING_MAX_FILES'] = int(os.getenv("PROFILING_MAX_FILES", 100))
+
+if app.config['PROXY_FIX_HOPS']:
+    # Sin esto remote_addr es la IP del proxy y todos los clientes comparten bucket
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'], x_proto=app.config['PROXY_FIX_HOPS'])
 
 MIGRATE = Migrate(app, db)
 db.init_app(app)
 CORS(app)
+schema_reports = SchemaReports()
+schema_reports.init_app(app)
 setup_admin(app)
 
+single_flight = SingleFlight()
+rate_limiter = RateLimiter()
+rate_limiter.init_app(app)
+response_cache = ResponseCache()
+response_cache.init_app(app)
+profiler = Profiler()
+profiler.init_app(app)
+
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+# Limita las peticiones por IP del cliente. El user_id lo elige el propio cliente,
+# así que solo se usa como clave si un proxy autenticado fija la cabecera X-User-Id.
+# El panel de administración y los ficheros estáticos no cuentan.
+@app.before_request
+def limit_requests():
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return
+    if request.endpoint == "static" or request.path.startswith("/admin"):
+        return
+    user_id = request.headers.get("X-User-Id") if app.config['RATE_LIMIT_TRUST_USER_ID'] else None
+    client_key = f"user:{user_id}" if user_id else f"ip:{request.remote_addr}"
+    if not rate_limiter.allow(client_key):
+        raise APIException("Too many requests", status_code=429)
+
+# Las lecturas idénticas y concurrentes comparten una sola consulta y el JSON ya serializado
+def coalesced_json(key, fn):
+    def load():
+        payload = fn()
+        return None if payload is None else app.json.dumps(payload)
+    return single_flight.do(key, load)
+
+def json_response(body):
+    return app.response_class(body, mimetype="application/json")
+
+# Los listados se guardan comprimidos en la caché compartida por todos los workers;
+# se invalidan cuando cambia cualquiera de las tablas de las que dependen
+def cached_json_response(name, tables, fn):
+    body = response_cache.get_or_compute(name, tables, lambda: coalesced_json(name, fn).encode())
+    if "gzip" not in request.accept_encodings:
+        return json_response(gzip.decompress(body))
+
+    response = json_response(body)
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return jsonify({**metrics.snapshot(), **response_cache.stats()})
+
 # generate sitemap with all your endpoints
 @app.route('/')
 def sitemap():
@@ -39,14 +122,13 @@ def sitemap():
 # Obtiene los personajes registrados
 @app.route('/people', methods=['GET'])
 def handle_people():
+    def load_people():
+        # Muestra una lista de People como filas de solo lectura.
+        people_list = [People.serialize_row(ppl) for ppl in People.read_only()]
+        return {"result": people_list}
+
     try:
-        people_list = []
-        # Muestra una lista de objetos People.
-        people = db.session.execute(db.select(People)).scalars().all()
-        for ppl in people:
-            people_list.append(ppl.serialize())
-        
-        return jsonify({"result": people_list})
+        return cached_json_response("people", ["people"], load_people)
     except Exception as e:
         return jsonify({"error": str("e")}), 500
 
@@ -67,44 +149,72 @@ def handle_person_by_id(people_id):
 
 
 
+# Lista los usuarios por páginas usando el id como cursor (?after=<id>&limit=<n>)
 @app.route('/user', methods=['GET'])
+@app.route('/users', methods=['GET'])
 def handle_user():
+    after = request.args.get("after", 0, type=int)
+    limit = min(request.args.get("limit", 50, type=int), 100)
+    if limit < 1:
+        raise APIException("limit must be a positive number")
+
     try:
-        user_list = []
-        user= db.session.execute(db.select(User)).scalars().all()
-        for u in user:
-            user_list.append(u.serialize())
-        
-        return jsonify({"result": user_list})
+        query = User.select_public().where(User.id > after).order_by(User.id).limit(limit)
+        user_list = [User.serialize_public(u) for u in db.session.execute(query)]
+        next_after = user_list[-1]["id"] if len(user_list) == limit else None
+
+        return jsonify({"result": user_list, "next": next_after})
     except Exception as e:
-        return jsonify({"error": str("e")}), 500
+        return jsonify({"error": str(e)}), 500
+
+# Busca un usuario por username o email usando sus índices únicos
+@app.route('/users/by-username/<string:username>', methods=['GET'])
+def handle_user_by_username(username):
+    return get_public_user(User.username == username)
+
+@app.route('/users/by-email/<string:email>', methods=['GET'])
+def handle_user_by_email(email):
+    return get_public_user(User.email == email)
+
+def get_public_user(condition):
+    try:
+        user = db.session.execute(User.select_public().where(condition)).one_or_none()
+        if user is None:
+            return jsonify({"error": "User not found"}), 404
+
+        return jsonify({"result": User.serialize_public(user)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 # Obtiene los planetas registrados    
 @app.route('/planets', methods=['GET'])
 def handle_planets():
+    def load_planets():
+        planets_list = [Planet.serialize_row(p) for p in Planet.read_only()]
+        return {"result": planets_list}
+
     try:
-        planets_list = []
-        planet= db.session.execute(db.select(Planet)).scalars().all()
-        for p in planet:
-            planets_list.append(p.serialize())
-        
-        return jsonify({"result": planets_list})
+        return cached_json_response("planets", ["planet"], load_planets)
     except Exception as e:
         return jsonify({"error": str("e")}), 500
     
 # Obtiene los personajes registrados por ID
 @app.route('/planets/<int:planet_id>', methods=['GET'])
 def handle_planet_by_id(planet_id):
-    try:
-        # Busca un personaje específico por ID
+    def load_planet():
+        # Busca un planeta específico por ID
         planet = db.session.execute(db.select(Planet).filter_by(id=planet_id)).scalar_one_or_none()
+        return None if planet is None else {"result": planet.serialize()}
+
+    try:
         # Si no se encuentra, devuelve un error 404
-        if planet is None:
+        body = coalesced_json(f"planet:{planet_id}", load_planet)
+        if body is None:
             return jsonify({"error": "Planet not found"}), 404
-        
+
         # Si se encuentra, devuelve su información
-        return jsonify({"result": planet.serialize()})
+        return json_response(body)
     except Exception as e:
         return jsonify({"error": str("e")}), 500
 
@@ -112,31 +222,72 @@ def handle_planet_by_id(planet_id):
 
 @app.route('/user/favorites', methods=['GET'])
 def get_all_users_favorites():
+    def load_favorites():
+        # Trae todos los favoritos con el nombre de cada elemento en una sola consulta
+        query = (
+            db.select(
+                Favorite.id, Favorite.user_id,
+                People.name.label("people"), Favorite.people_id,
+                Planet.name.label("planet"), Favorite.planet_id,
+                Vehicle.name.label("vehicle"), Favorite.vehicle_id
+            )
+            .outerjoin(People, Favorite.people_id == People.id)
+            .outerjoin(Planet, Favorite.planet_id == Planet.id)
+            .outerjoin(Vehicle, Favorite.vehicle_id == Vehicle.id)
+            .order_by(Favorite.id)
+        )
+        favorites_list = [fav._asdict() for fav in db.session.execute(query)]
+        return {"favorites": favorites_list}
+
     try:
-        favorites_list = []
-        # Trae todos los registros de favoritos
-        favorites = db.session.execute(db.select(Favorite)).scalars().all()
-        
-        for fav in favorites:
-            favorites_list.append({
-                "id": fav.id,
-                "user_id": fav.user_id,
-                "people": fav.people.name if fav.people else None,
-                "people_id": fav.id if fav.people else None,
-                "planet": fav.planet.name if fav.planet else None,
-                "planet_id": fav.id if fav.planet else None,
-                "vehicle": fav.vehicle.name if fav.vehicle else None,
-                "vehicle_id": fav.id if fav.vehicle else None
-            })
-        
-        return jsonify({"favorites": favorites_list}), 200
+        return cached_json_response("favorites", ["favorite", "people", "planet", "vehicle"], load_favorites)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 
+# Devuelve las filas del catálogo creadas, editadas o borradas desde el token `since`.
+# El token es el `next` de la llamada anterior: microsegundos UTC desde epoch, seguro en una URL.
+# Las respuestas se solapan (CHANGES_SAFETY_WINDOW segundos), así que el cliente
+# debe aplicar los cambios como upsert/borrado por id.
+@app.route('/changes', methods=['GET'])
+def handle_changes():
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            if not (since.isascii() and since.isdigit()):
+                raise ValueError(since)
+            # Las columnas guardan la hora UTC sin zona horaria
+            since = datetime.fromtimestamp(int(since) / 1_000_000, timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError, OSError):
+            raise APIException("since must be a token returned by /changes")
+        # `edited` se fija al hacer flush, en el reloj de otro worker, y la fila puede
+        # confirmarse más tarde. Se vuelve a pedir una ventana de margen por detrás del
+        # token: el cliente puede recibir filas repetidas y las reemplaza por su id.
+        since -= timedelta(seconds=app.config['CHANGES_SAFETY_WINDOW'])
+
+    try:
+        # Se toma antes de consultar para no perder filas editadas durante la consulta
+        next_token = utcnow()
+        changes = {}
+        for name, model in CATALOG_MODELS.items():
+            criteria = [] if since is None else [model.edited >= since]
+            changes[name] = [model.serialize_row(row) for row in model.read_only(*criteria, order_by=model.edited)]
+
+        deleted = []
+        if since is not None:
+            query = db.select(Tombstone).where(Tombstone.deleted_at >= since).order_by(Tombstone.deleted_at)
+            deleted = [t.serialize() for t in db.session.execute(query).scalars()]
+
+        next_token = str(int(next_token.timestamp() * 1_000_000))
+        return jsonify({"result": changes, "deleted": deleted, "next": next_token}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # Añade un nuevo Planeta Favorito al Usuario actual con el id del Planeta
 @app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
+@session_options(expire_on_commit=False)
 def add_favorite_planet(planet_id):
     try:
         print(planet_id)
@@ -168,6 +319,7 @@ def add_favorite_planet(planet_id):
 
 # Añade un nuevo Personaje Favorito al Usuario actual con el id del Personaje.
 @app.route('/favorite/people/<int:people_id>', methods=['POST'])
+@session_options(expire_on_commit=False)
 def add_favorite_people(people_id):
     try:
         print(people_id)
@@ -199,6 +351,7 @@ def add_favorite_people(people_id):
 
 # Elimina un Planeta Favorito con el id del Planeta.
 @app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
+@session_options(expire_on_commit=False)
 def del_favorite_planet(planet_id):
     try:
         data = request.get_json()
@@ -224,6 +377,7 @@ def del_favorite_planet(planet_id):
 
 # Elimina un People Favorito con el id de People.
 @app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
+@session_options(expire_on_commit=False)
 def del_favorite_people(people_id):
     try:
         data = request.get_json()
@@ -1,12 +1,54 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Integer, ForeignKey, Table, Column, DateTime, Text 
+from sqlalchemy import String, Boolean, Integer, ForeignKey, Table, Column, DateTime, Text, event, insert
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from eralchemy2 import render_er
 from datetime import datetime, timezone
+from collections import namedtuple
+from functools import wraps
 
 # Inicializar Flask-SQLAlchemy
 db = SQLAlchemy()
 
+def utcnow():
+    return datetime.now(timezone.utc)
+
+# Cambia opciones de la sesión (expire_on_commit, autoflush...) solo durante una ruta
+def session_options(**options):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            session = db.session()
+            previous = {name: getattr(session, name) for name in options}
+            for name, value in options.items():
+                setattr(session, name, value)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                for name, value in previous.items():
+                    setattr(session, name, value)
+        return wrapper
+    return decorator
+
+_row_types = {}
+
+# Lectura de solo lectura: filas de Core convertidas en namedtuples (sin __dict__,
+# sin estado de instancia ni identity map), para listados que solo se serializan
+class ReadOnlyMixin:
+    @classmethod
+    def row_type(cls):
+        if cls not in _row_types:
+            _row_types[cls] = namedtuple(f"{cls.__name__}Row", cls.__table__.columns.keys())
+        return _row_types[cls]
+
+    @classmethod
+    def read_only(cls, *criteria, order_by=None):
+        query = db.select(cls.__table__).where(*criteria).order_by(order_by if order_by is not None else cls.__table__.c.id)
+        row_type = cls.row_type()
+        return [row_type._make(row) for row in db.session.execute(query)]
+
+    @staticmethod
+    def serialize_row(row):
+        return row._asdict()
+
 # Una tabla User - Favorite → Uno-a-muchos (Un usuario puede tener muchos favoritos, pero cada favorito pertenece a un solo usuario).
 # Una tabla User - Post     → Uno-a-muchos (Un usuario puede escribir varios posts, pero un post pertenece a un solo usuario).
 # Una tabla Post - Comment  → Uno-a-muchos (Un post puede tener varios comentarios, pero cada comentario pertenece a un solo post).
@@ -35,12 +77,24 @@ class User(db.Model):
             "username": self.username,
             "first_name": self.first_name,
             "last_name": self.last_name,
-            "email": self.email,
-            "password": self.password
+            "email": self.email
             # do not serialize the password, its a security breach
         }
 
-class People(db.Model):
+    # Columnas públicas: se seleccionan solo estas para no cargar la fila completa ni el password
+    @classmethod
+    def public_columns(cls):
+        return (cls.id, cls.username, cls.first_name, cls.last_name, cls.email)
+
+    @classmethod
+    def select_public(cls):
+        return db.select(*cls.public_columns())
+
+    @staticmethod
+    def serialize_public(row):
+        return row._asdict()
+
+class People(ReadOnlyMixin, db.Model):
     __tablename__ = 'people'
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), nullable=False)
@@ -53,7 +107,7 @@ class People(db.Model):
     skin_color: Mapped[str] = mapped_column(String(50), nullable=False)
     url: Mapped[str] = mapped_column(String(150), nullable=False)
     created: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
-    edited: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False)
+    edited: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc), nullable=False, index=True)
 
     # Metodo mágico para mostrar un texto
     def __str__(self):
@@ -79,11 +133,12 @@ class People(db.Model):
     def get_by_id(cls, people_id: int):
         return db.session.execute(db.select(cls).filter_by(id=people_id)).scalar_one_or_none()
 
-class Planet(db.Model):
+class Planet(ReadOnlyMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), nullable=False)
     climate: Mapped[str] = mapped_column(String(50), nullable=False)
     terrain: Mapped[str] = mapped_column(String(50), nullable=False)
+    edited: Mapped[datetime] = mapped_column(DateTime, default=utcnow, onupdate=utcnow, nullable=False, index=True)
 
     def __str__(self):
         return self.name
@@ -93,15 +148,17 @@ class Planet(db.Model):
             "id": self.id,
             "name": self.name,
             "climate": self.climate,
-            "terrain": self.terrain
+            "terrain": self.terrain,
+            "edited": self.edited
         }
 
-class Vehicle(db.Model):
+class Vehicle(ReadOnlyMixin, db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), nullable=False)
     model: Mapped[str] = mapped_column(String(50), nullable=False)
     manufacturer: Mapped[str] = mapped_column(String(50), nullable=False)
     capacity: Mapped[int] = mapped_column(Integer, nullable=False)
+    edited: Mapped[datetime] = mapped_column(DateTime, default=utcnow, onupdate=utcnow, nullable=False, index=True)
 
     def __str__(self):
         return self.name
@@ -112,15 +169,45 @@ class Vehicle(db.Model):
             "name": self.name,
             "model": self.model,
             "manufacturer": self.manufacturer,
-            "capacity": self.capacity
+            "capacity": self.capacity,
+            "edited": self.edited
+        }
+
+# Registro de filas borradas del catálogo, para que los clientes puedan sincronizar los borrados
+class Tombstone(db.Model):
+    id: Mapped[int] = mapped_column(primary_key=True)
+    table_name: Mapped[str] = mapped_column(String(50), nullable=False)
+    row_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow, nullable=False, index=True)
+
+    def serialize(self):
+        return {
+            "table": self.table_name,
+            "id": self.row_id,
+            "deleted_at": self.deleted_at
         }
 
+# Modelos del catálogo que exponen cambios en /changes
+CATALOG_MODELS = {"people": People, "planets": Planet, "vehicles": Vehicle}
+
+# Cada borrado por ORM de un modelo del catálogo deja una lápida en la misma transacción.
+# Los borrados masivos (db.session.execute(delete(...))) no disparan este evento.
+def record_tombstone(mapper, connection, target):
+    connection.execute(insert(Tombstone.__table__).values(
+        table_name=mapper.local_table.name,
+        row_id=target.id,
+        deleted_at=utcnow()
+    ))
+
+for catalog_model in CATALOG_MODELS.values():
+    event.listen(catalog_model, "after_delete", record_tombstone)
+
 class Favorite(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
-    people_id: Mapped[int] = mapped_column(ForeignKey("people.id", ondelete="CASCADE"), nullable=True)
-    planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id", ondelete="CASCADE"), nullable=True)
-    vehicle_id: Mapped[int] = mapped_column(ForeignKey("vehicle.id", ondelete="CASCADE"), nullable=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
+    people_id: Mapped[int] = mapped_column(ForeignKey("people.id", ondelete="CASCADE"), nullable=True, index=True)
+    planet_id: Mapped[int] = mapped_column(ForeignKey("planet.id", ondelete="CASCADE"), nullable=True, index=True)
+    vehicle_id: Mapped[int] = mapped_column(ForeignKey("vehicle.id", ondelete="CASCADE"), nullable=True, index=True)
     # Relaciones
     user: Mapped[list['User']] = relationship("User", back_populates="favorites")
     people: Mapped[list['People']] = relationship("People")
@@ -139,7 +226,7 @@ class Favorite(db.Model):
 
 class Post(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
     title: Mapped[str] = mapped_column(String(250), nullable=False)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now(timezone.utc))
@@ -149,8 +236,8 @@ class Post(db.Model):
 
 class Comment(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
-    post_id: Mapped[int] = mapped_column(ForeignKey("post.id"), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False, index=True)
+    post_id: Mapped[int] = mapped_column(ForeignKey("post.id"), nullable=False, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now(timezone.utc))
     # Relaciones
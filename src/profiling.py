@@ -0,0 +1,288 @@
+"""
+On-demand per-request profiling (cProfile or a low-overhead stack sampler),
+with the time split into DB / ORM / serialization / framework / response cache / app code
+"""
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+import click
+from flask import g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from throttle import MemoryStore, metrics
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = os.path.join(APP_DIR, "response_cache.py")
+MODES = ("cprofile", "sample")
+
+# Desde Python 3.12 cProfile usa sys.monitoring: solo puede haber un perfil activo por
+# proceso y registra todos los hilos. Este lock asegura un único perfil cProfile a la vez,
+# y Profiler solo lo arranca cuando no hay otras peticiones en curso en el worker.
+_cprofile_lock = threading.Lock()
+
+# La primera regla que coincide con la ruta del fichero decide la categoría.
+# "db" es el tiempo en la base de datos de la app: el SQLite de la caché de respuestas va a "cache".
+CATEGORIES = [
+    ("db", ("sqlalchemy/engine", "sqlalchemy/pool", "sqlalchemy/dialects", "sqlite3", "psycopg2", "MySQLdb")),
+    ("orm", ("sqlalchemy",)),
+    ("serialization", ("json",)),
+    ("framework", ("flask", "werkzeug")),
+]
+
+
+def classify(filename):
+    if filename == CACHE_FILE:
+        return "cache"
+    if filename.startswith(APP_DIR):
+        return "app"
+    path = filename.replace("\\", "/")
+    for category, patterns in CATEGORIES:
+        if any(pattern in path for pattern in patterns):
+            return category
+    return None
+
+
+def sign_token(secret, mode, expires):
+    signature = hmac.new(secret.encode(), f"{mode}:{expires}".encode(), hashlib.sha256).hexdigest()
+    return f"{mode}:{expires}:{signature}"
+
+
+def verify_token(secret, token):
+    try:
+        mode, expires, _ = token.split(":")
+        expired = int(expires) < time.time()
+    except ValueError:
+        return None
+    if expired or mode not in MODES:
+        return None
+    return mode if hmac.compare_digest(sign_token(secret, mode, expires), token) else None
+
+
+# Muestrea la pila del hilo de la petición desde otro hilo cada `interval` segundos
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.breakdown = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            category = None
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                if category is None:
+                    category = classify(code.co_filename)
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.breakdown[category or "other"] += self.interval
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    # Formato "collapsed stack" (una línea por pila con su número de muestras), legible por flamegraph.pl
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def cprofile_breakdown(profile):
+    breakdown = Counter()
+    for (filename, _, function), (_, _, self_time, _, callers) in pstats.Stats(profile).stats.items():
+        # Las funciones en C aparecen con fichero "~" y el módulo en el nombre
+        category = classify(function if filename == "~" else filename) or "other"
+        if category == "db":
+            # El driver sqlite3 llamado desde la caché de respuestas no es tiempo de la base de datos
+            for (caller_file, _, _), (_, _, caller_time, _) in callers.items():
+                if caller_file == CACHE_FILE:
+                    breakdown["cache"] += caller_time
+                    self_time -= caller_time
+        breakdown[category] += self_time
+    return breakdown
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.secret = None
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.output_dir = "/tmp/profiles"
+        self.limiter = MemoryStore()
+        self.max_per_minute = 6
+        self.max_files = 100
+        self._active_lock = threading.Lock()
+        self._active = 0
+        self._cprofile_profile = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get("PROFILING_ENABLED", self.enabled)
+        self.secret = app.config.get("PROFILING_SECRET", self.secret)
+        self.sample_rate = float(app.config.get("PROFILING_SAMPLE_RATE", self.sample_rate))
+        self.interval = float(app.config.get("PROFILING_INTERVAL", self.interval))
+        self.output_dir = app.config.get("PROFILING_DIR", self.output_dir)
+        self.max_per_minute = int(app.config.get("PROFILING_MAX_PER_MINUTE", self.max_per_minute))
+        self.max_files = int(app.config.get("PROFILING_MAX_FILES", self.max_files))
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.abort)
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+        @app.cli.command("profile-token")
+        @click.argument("mode", type=click.Choice(MODES), default="sample")
+        @click.option("--ttl", default=3600, help="Seconds the token stays valid.")
+        def profile_token_command(mode, ttl):
+            """Print a signed X-Profile header value."""
+            if not self.secret:
+                raise click.ClickException("PROFILING_SECRET is not set")
+            click.echo(sign_token(self.secret, mode, int(time.time()) + ttl))
+
+    def requested_mode(self):
+        token = request.headers.get("X-Profile")
+        if token and self.secret:
+            return verify_token(self.secret, token)
+        param = request.args.get("__profile")
+        if param and self.enabled:
+            return param if param in MODES else "sample"
+        # En producción se puede dejar un muestreo automático a baja frecuencia
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def start(self):
+        # Se cuentan todas las peticiones en curso del worker, no solo las perfiladas
+        with self._active_lock:
+            self._active += 1
+            if self._cprofile_profile is not None:
+                # El cProfile en marcha también registrará lo que haga esta petición
+                self._cprofile_profile["overlapped"] = True
+        g.profile_active = True
+
+        mode = self.requested_mode()
+        if mode is None:
+            return
+        # Nunca más de `max_per_minute` perfiles por worker, aunque se pidan más
+        if not self.limiter.take("profiles", self.max_per_minute / 60, self.max_per_minute):
+            metrics.incr("profiles_skipped")
+            return
+
+        profile = {"mode": mode, "db_time": 0.0, "overlapped": False}
+        profile["profiler"] = self._start_cprofile(profile) if mode == "cprofile" else None
+        if profile["profiler"] is None:
+            if mode == "cprofile":
+                # Hay otras peticiones u otro cProfile en este proceso: se muestrea la pila en su lugar
+                metrics.incr("profiles_downgraded")
+            profile["mode"] = "sample"
+            profile["profiler"] = StackSampler(threading.get_ident(), self.interval)
+            profile["profiler"].start()
+        profile["started"] = time.perf_counter()
+        g.profile = profile
+
+    def _start_cprofile(self, profile):
+        with self._active_lock:
+            if self._active > 1 or not _cprofile_lock.acquire(blocking=False):
+                return None
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Otra herramienta de profiling (otro depurador o profiler) ocupa sys.monitoring
+                _cprofile_lock.release()
+                return None
+            self._cprofile_profile = profile
+        return profiler
+
+    def _stop(self, profile):
+        if profile["mode"] == "cprofile":
+            with self._active_lock:
+                profile["profiler"].disable()
+                self._cprofile_profile = None
+            _cprofile_lock.release()
+        else:
+            profile["profiler"].stop()
+
+    def finish(self, response):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return response
+        self._stop(profile)
+        elapsed = time.perf_counter() - profile["started"]
+        # Una petición más corta que el intervalo de muestreo no deja muestras:
+        # no se escribe nada y se devuelve el cupo
+        if profile["mode"] == "sample" and not profile["profiler"].stacks:
+            self.limiter.refund("profiles", self.max_per_minute)
+            metrics.incr("profiles_empty")
+            return response
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{request.endpoint}-{os.getpid()}-{threading.get_ident()}"
+        if profile["mode"] == "cprofile":
+            path = os.path.join(self.output_dir, f"{name}.pstats")
+            profile["profiler"].dump_stats(path)
+            breakdown = cprofile_breakdown(profile["profiler"])
+        else:
+            path = os.path.join(self.output_dir, f"{name}.collapsed")
+            profile["profiler"].dump(path)
+            breakdown = profile["profiler"].breakdown
+        metrics.incr("profiles_written")
+        self._prune()
+
+        summary = {"total": elapsed, "db_execute": profile["db_time"], **breakdown}
+        response.headers["X-Profile-Report"] = os.path.basename(path)
+        if profile["overlapped"]:
+            # Otra petición empezó mientras tanto y su trabajo está mezclado en el perfil
+            response.headers["X-Profile-Scope"] = "process"
+            metrics.incr("profiles_overlapped")
+        response.headers["X-Profile-Breakdown"] = ";".join(
+            f"{category}={seconds * 1000:.1f}ms" for category, seconds in summary.items()
+        )
+        return response
+
+    # Conserva solo los `max_files` informes más recientes del directorio
+    def _prune(self):
+        reports = [
+            entry for entry in os.scandir(self.output_dir)
+            if entry.is_file() and entry.name.endswith((".pstats", ".collapsed"))
+        ]
+        reports.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in reports[:max(len(reports) - self.max_files, 0)]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def abort(self, error=None):
+        # Si la petición terminó con una excepción no se llegó a after_request
+        profile = g.pop("profile", None)
+        if profile is not None:
+            self._stop(profile)
+        if g.pop("profile_active", False):
+            with self._active_lock:
+                self._active -= 1
+
+    # Tiempo real dentro del driver de la base de datos, medido con eventos del engine
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["profile_query_start"] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("profile_query_start", None)
+        profile = g.get("profile") if has_app_context() else None
+        if profile is not None and started is not None:
+            profile["db_time"] += time.perf_counter() - started
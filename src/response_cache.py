@@ -0,0 +1,248 @@
+"""
+Response cache shared by all the gunicorn workers, with stampede protection
+and invalidation by table generation
+"""
+import gzip
+import logging
+import math
+import random
+import sqlite3
+import struct
+import threading
+import time
+from collections import Counter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+STATS = ("cache_hits", "cache_stale_hits", "cache_misses", "cache_early_recomputes", "cache_recomputes")
+
+# Cabecera de cada entrada: expiración (epoch) y segundos que costó calcularla
+_HEADER = struct.Struct("!dd")
+
+
+# Backend local: un fichero SQLite que comparten los procesos de la misma máquina
+class SQLiteBackend:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, value, now + ttl))
+        # De vez en cuando se limpian las entradas caducadas de generaciones anteriores
+        if random.random() < 0.01:
+            conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    # Escribe solo si la clave no existe o caducó; devuelve True si la escribió
+    def add(self, key, value, ttl):
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO cache VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET value = excluded.value, expires = excluded.expires WHERE cache.expires <= ?",
+            (key, value, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, amount=1):
+        return self._conn().execute(
+            "INSERT INTO cache VALUES (?, ?, NULL) ON CONFLICT(key) DO UPDATE SET value = value + ? RETURNING value",
+            (key, amount, amount)
+        ).fetchone()[0]
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+# Backend de red sobre un cliente con la interfaz de redis-py (get, set con ex/nx, incr, delete)
+class NetworkBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=math.ceil(ttl))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, ex=math.ceil(ttl), nx=True))
+
+    def incr(self, key, amount=1):
+        return self.client.incr(key, amount)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+# Sustituto local del cliente de red, para desarrollo y pruebas sin servidor
+class LocalClient:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def _live(self, key):
+        value, expires = self._data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value, None if ex is None else time.time() + ex)
+            return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._live(key) or 0) + amount
+            self._data[key] = (value, None)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=60, beta=1.0, lock_timeout=10, stats_flush_interval=5):
+        self.backend = backend
+        self.ttl = ttl
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.stats_flush_interval = stats_flush_interval
+        self._stats_lock = threading.Lock()
+        self._pending_stats = Counter()
+        self._stats_flushed = time.monotonic()
+
+    def init_app(self, app):
+        self.ttl = float(app.config.get("RESPONSE_CACHE_TTL", self.ttl))
+        self.stats_flush_interval = float(app.config.get("RESPONSE_CACHE_STATS_FLUSH_INTERVAL", self.stats_flush_interval))
+        if self.backend is None:
+            backend = app.config.get("RESPONSE_CACHE_BACKEND", "sqlite")
+            if backend == "sqlite":
+                self.backend = SQLiteBackend(app.config.get("RESPONSE_CACHE_PATH", "/tmp/response_cache.db"))
+            elif backend == "redis":
+                import redis
+                self.backend = NetworkBackend(redis.Redis.from_url(app.config["RESPONSE_CACHE_URL"]))
+            elif backend == "memory":
+                self.backend = NetworkBackend(LocalClient())
+            else:
+                raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend}")
+
+        # Cualquier commit que toque una tabla sube su generación e invalida sus respuestas
+        event.listen(Session, "after_flush", self._collect_tables)
+        event.listen(Session, "after_commit", self._bump_tables)
+        event.listen(Session, "after_rollback", lambda session: session.info.pop("changed_tables", None))
+
+    def _collect_tables(self, session, flush_context):
+        tables = session.info.setdefault("changed_tables", set())
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            tables.add(obj.__table__.name)
+
+    # Se ejecuta con los datos ya confirmados: un fallo de la caché no puede convertir
+    # la petición en un 500. Las respuestas afectadas caducan solas con el TTL.
+    def _bump_tables(self, session):
+        for table_name in session.info.pop("changed_tables", ()):
+            try:
+                self.bump(table_name)
+            except Exception:
+                logger.exception("Could not invalidate cached responses for %s", table_name)
+
+    # Cada worker acumula sus contadores en memoria y los suma al backend compartido
+    # como mucho cada `stats_flush_interval` segundos, para no escribir en cada acierto
+    def count(self, name):
+        with self._stats_lock:
+            self._pending_stats[name] += 1
+            due = time.monotonic() - self._stats_flushed >= self.stats_flush_interval
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._stats_lock:
+            pending = self._pending_stats
+            self._pending_stats = Counter()
+            self._stats_flushed = time.monotonic()
+        try:
+            for name, amount in pending.items():
+                self.backend.incr(f"stats:{name}", amount)
+                pending[name] = 0
+        except Exception:
+            logger.exception("Could not flush cache stats")
+            # Lo que no se pudo escribir se vuelve a intentar en el siguiente flush
+            with self._stats_lock:
+                self._pending_stats.update(+pending)
+
+    # Suma de todos los workers; los de los demás pueden ir hasta `stats_flush_interval` por detrás
+    def stats(self):
+        self.flush_stats()
+        return {name: int(self.backend.get(f"stats:{name}") or 0) for name in STATS}
+
+    def bump(self, table_name):
+        self.backend.incr(f"generation:{table_name}")
+
+    def key(self, name, tables):
+        generations = [f"{t}={int(self.backend.get(f'generation:{t}') or 0)}" for t in tables]
+        return f"response:{name}:{':'.join(generations)}"
+
+    # Devuelve el cuerpo comprimido con gzip. Con expiración temprana probabilística
+    # (XFetch) un solo worker, el que consigue el lock, recalcula antes de que caduque
+    def get_or_compute(self, name, tables, compute):
+        key = self.key(name, tables)
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires, delta = _HEADER.unpack_from(entry)
+            if time.time() - delta * self.beta * math.log(1.0 - random.random()) < expires:
+                self.count("cache_hits")
+                return entry[_HEADER.size:]
+
+        lock_key = f"lock:{key}"
+        locked = self.backend.add(lock_key, b"1", self.lock_timeout)
+        if not locked:
+            if entry is not None:
+                self.count("cache_stale_hits")
+                return entry[_HEADER.size:]
+            # Otro worker está calculando y aún no hay nada que servir: se espera a su resultado
+            deadline = time.time() + self.lock_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.count("cache_hits")
+                    return entry[_HEADER.size:]
+
+        self.count("cache_misses" if entry is None else "cache_early_recomputes")
+        try:
+            start = time.time()
+            body = gzip.compress(compute())
+            delta = time.time() - start
+            # La entrada vive el doble del TTL para poder servirla mientras otro la recalcula
+            self.backend.set(key, _HEADER.pack(start + delta + self.ttl, delta) + body, self.ttl * 2)
+            self.count("cache_recomputes")
+            return body
+        finally:
+            if locked:
+                self.backend.delete(lock_key)
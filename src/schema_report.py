@@ -0,0 +1,190 @@
+"""
+ER diagram and per-table schema report, rendered in a separate worker process
+and cached on disk by Alembic head revision
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import click
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, inspect, text, func, select, table, literal_column
+from utils import APIException
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "migrations")
+
+
+def head_revision():
+    return ScriptDirectory(MIGRATIONS_DIR).get_current_head()
+
+
+def estimate_rows(connection, table_name, where=None):
+    """Estimate the rows of ``table_name`` matching the SQL condition ``where``.
+
+    Postgres answers from the planner statistics (pg_class.reltuples, or
+    EXPLAIN when there is a condition) without scanning the table. Other
+    databases, and Postgres tables never analyzed, fall back to COUNT(*).
+    """
+    if connection.dialect.name == "postgresql":
+        if where is None:
+            estimate = connection.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:name)"),
+                {"name": f'"{table_name}"'}
+            ).scalar()
+        else:
+            query = select(literal_column("1")).select_from(table(table_name)).where(text(where))
+            plan = connection.execute(
+                text(f"EXPLAIN (FORMAT JSON) {query.compile(dialect=connection.dialect)}")
+            ).scalar()
+            estimate = plan[0]["Plan"]["Plan Rows"]
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+
+    query = select(func.count()).select_from(table(table_name))
+    if where is not None:
+        query = query.where(text(where))
+    return connection.execute(query).scalar()
+
+
+def missing_fk_indexes(inspector, table_name):
+    # Una FK está cubierta si sus columnas son el prefijo de algún índice o de la PK
+    prefixes = [index["column_names"] for index in inspector.get_indexes(table_name)]
+    prefixes.append(inspector.get_pk_constraint(table_name)["constrained_columns"])
+    warnings = []
+    for fk in inspector.get_foreign_keys(table_name):
+        columns = fk["constrained_columns"]
+        if not any(prefix[:len(columns)] == columns for prefix in prefixes):
+            warnings.append(f"{table_name}({', '.join(columns)}) references {fk['referred_table']} without an index")
+    return warnings
+
+
+def build_report(db_url, output_dir):
+    # Se ejecuta en el proceso worker: crea su propio engine, nunca usa el de la app
+    engine = create_engine(db_url)
+    try:
+        inspector = inspect(engine)
+        tables = {}
+        with engine.connect() as connection:
+            for table_name in inspector.get_table_names():
+                tables[table_name] = {
+                    "row_estimate": estimate_rows(connection, table_name),
+                    "indexes": [
+                        {"name": index["name"], "columns": index["column_names"], "unique": bool(index["unique"])}
+                        for index in inspector.get_indexes(table_name)
+                    ],
+                    "warnings": missing_fk_indexes(inspector, table_name)
+                }
+    finally:
+        engine.dispose()
+
+    os.makedirs(output_dir, exist_ok=True)
+    report = {"tables": tables, "diagram": None}
+    try:
+        from eralchemy2 import render_er
+        diagram_path = os.path.join(output_dir, "diagram.png")
+        render_er(db_url, diagram_path)
+        report["diagram"] = diagram_path
+    except Exception as e:
+        report["diagram_error"] = str(e)
+
+    # Escritura atómica para que otros procesos nunca lean un informe a medias
+    report_path = os.path.join(output_dir, "report.json")
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, report_path)
+    return report
+
+
+class SchemaReports:
+    def __init__(self, cache_dir="/tmp/schema_reports", retry_after=60):
+        self.cache_dir = cache_dir
+        self.retry_after = retry_after
+        self.db_url = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._failures = {}
+
+    def init_app(self, app):
+        self.cache_dir = app.config.get("SCHEMA_REPORT_DIR", self.cache_dir)
+        self.retry_after = float(app.config.get("SCHEMA_REPORT_RETRY_AFTER", self.retry_after))
+        self.db_url = app.config["SQLALCHEMY_DATABASE_URI"]
+        app.extensions["schema_reports"] = self
+
+        @app.cli.command("schema-report")
+        def schema_report_command():
+            """Render the ER diagram and schema report for the current head revision."""
+            report = self.build()
+            for table_name, info in report["tables"].items():
+                click.echo(f"{table_name}: ~{info['row_estimate']} rows, {len(info['indexes'])} indexes")
+                for warning in info["warnings"]:
+                    click.echo(f"  warning: {warning}")
+            click.echo(f"diagram: {report['diagram'] or report.get('diagram_error')}")
+
+    def output_dir(self, revision=None):
+        return os.path.join(self.cache_dir, revision or head_revision())
+
+    def report_path(self, revision=None):
+        return os.path.join(self.output_dir(revision), "report.json")
+
+    def cached(self, revision=None):
+        try:
+            with open(self.report_path(revision)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # Un informe sin diagrama (faltaba eralchemy2 o graphviz) no cuenta como terminado
+    def build(self):
+        revision = head_revision()
+        report = self.cached(revision)
+        if report is None or report["diagram"] is None:
+            report = build_report(self.db_url, self.output_dir(revision))
+        return report
+
+    # Devuelve el informe si ya está en disco; si no, lo encarga al worker y devuelve None.
+    # Si la última generación falló, responde con el error hasta pasados `retry_after` segundos.
+    # Un informe sin diagrama se devuelve tal cual y el diagrama se reintenta cada `retry_after` segundos.
+    def get_or_submit(self):
+        revision = head_revision()
+        report = self.cached(revision)
+        if report is not None and report["diagram"] is not None:
+            return report
+
+        # Con workers gthread varias peticiones del admin pueden llegar a la vez
+        with self._lock:
+            return self._submit(revision)
+
+    def _submit(self, revision):
+        future = self._pending.get(revision)
+        if future is not None and future.done():
+            del self._pending[revision]
+            error = future.exception()
+            if error is not None:
+                self._failures[revision] = (str(error), time.time())
+                # Un BrokenProcessPool deja el executor inservible
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+        failure = self._failures.get(revision)
+        if failure is not None and time.time() - failure[1] >= self.retry_after:
+            del self._failures[revision]
+            failure = None
+
+        # Otro hilo pudo terminar de esperar al worker mientras este esperaba el lock
+        report = self.cached(revision)
+        if report is not None and report["diagram"] is not None:
+            return report
+        if report is None and failure is not None:
+            raise APIException(f"Schema report failed: {failure[0]}", status_code=500)
+
+        due = report is None or time.time() - os.path.getmtime(self.report_path(revision)) >= self.retry_after
+        if failure is None and due and revision not in self._pending:
+            if self._executor is None:
+                # Hacer fork desde un worker con varios hilos no es seguro: el proceso nuevo arranca limpio
+                self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            self._pending[revision] = self._executor.submit(build_report, self.db_url, self.output_dir(revision))
+        return report
@@ -0,0 +1,127 @@
+"""
+Coalescing of identical reads and token-bucket rate limiting for the API endpoints
+"""
+import threading
+import time
+
+
+# Cuenta peticiones agrupadas y rechazadas. Cada worker lleva sus propios contadores.
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+metrics = Metrics()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Single-flight: las lecturas concurrentes con la misma clave comparten
+# una sola consulta en curso y el mismo resultado serializado.
+# Solo agrupa peticiones dentro de un mismo proceso, así que necesita workers con
+# varios hilos (gunicorn --worker-class gthread, ver Procfile); con workers sync no hace nada.
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.incr("coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.incr("executed")
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+# Almacén en memoria de los buckets: {clave: (tokens, último_refill)}.
+# Un almacén compartido (por ejemplo Redis) solo tiene que implementar `take`.
+class MemoryStore:
+    def __init__(self, max_buckets=10000):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.max_buckets = max_buckets
+
+    def take(self, key, rate, capacity, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._evict(rate, capacity, now)
+            return allowed
+
+    # Devuelve un token que se tomó pero no llegó a usarse
+    def refund(self, key, capacity):
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + 1), last)
+
+    # Un bucket que ya se ha vuelto a llenar equivale a uno nuevo, así que se puede borrar.
+    # Si aun así sobran, se borran los que llevan más tiempo sin usarse hasta quedar en el 90%.
+    def _evict(self, rate, capacity, now):
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * rate < capacity
+        }
+        excess = len(self._buckets) - int(self.max_buckets * 0.9)
+        if excess > 0:
+            oldest = sorted(self._buckets, key=lambda key: self._buckets[key][1])[:excess]
+            for key in oldest:
+                del self._buckets[key]
+            metrics.incr("rate_limit_evicted", excess)
+
+
+class RateLimiter:
+    def __init__(self, rate=10.0, capacity=20, store=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.store = store if store is not None else MemoryStore()
+
+    def init_app(self, app):
+        self.rate = float(app.config.get("RATE_LIMIT_PER_SECOND", self.rate))
+        self.capacity = int(app.config.get("RATE_LIMIT_BURST", self.capacity))
+
+    def allow(self, client_key):
+        allowed = self.store.take(client_key, self.rate, self.capacity)
+        if not allowed:
+            metrics.incr("rate_limited")
+        return allowed